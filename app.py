@@ -1,26 +1,59 @@
 from fastapi import FastAPI, HTTPException, Depends, status, Request
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy import Column, Integer, String, create_engine
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import Column, Integer, String, event, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_scoped_session, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.concurrency import run_in_threadpool
 from passlib.context import CryptContext
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
+import jwt
+from datetime import timedelta
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.openapi.utils import get_openapi
 from fastapi.responses import JSONResponse
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.httpsredirect import HTTPSRedirectMiddleware
-from pydantic import BaseModel, constr
+from pydantic import BaseModel, ConfigDict, Field
+from cachetools import TTLCache
+import asyncio
+from contextlib import asynccontextmanager
+import hashlib
+import os
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
 
 # ==========================
 # Database Configuration
 # ==========================
-DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Resolved once: SQLAlchemy anchors a relative SQLite path at engine creation, so the existence check must too.
+DB_PATH = Path(os.getenv("DB_PATH", "./test.db")).resolve()
+DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=20,
+    max_overflow=40,
+    pool_recycle=3600,
+)
+
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers proceed during writes; NORMAL sync is safe under WAL and skips an fsync per commit.
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+# Sessions are scoped per request (see db_session_scope), so every dependency in one request shares a session.
+request_scope: ContextVar = ContextVar("request_scope", default=None)
+async_session_factory = sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+SessionLocal = async_scoped_session(async_session_factory, scopefunc=request_scope.get)
 Base = declarative_base()
 
 # ==========================
@@ -33,8 +66,23 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # ==========================
 # Password Hashing Configuration
 # ==========================
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+# New hashes use argon2id; existing bcrypt hashes still verify.
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+)
+
+# ==========================
+# Token Validation Cache
+# ==========================
+# Maps sha256(token) -> (username, User, exp) so repeat requests skip jwt.decode and the user lookup.
+# Entries live at most TOKEN_CACHE_TTL seconds (bounds revocation lag) and never past the token's exp.
+TOKEN_CACHE_TTL = 60
+token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL)
+token_cache_lock = threading.Lock()
 
 # ==========================
 # SQLAlchemy Models
@@ -52,172 +100,371 @@ class Item(Base):
     name = Column(String, index=True)
     description = Column(String)
 
-Base.metadata.create_all(bind=engine)
-
 # ==========================
 # FastAPI App + CORS + Rate Limiting + Security Headers
 # ==========================
-app = FastAPI()
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
-# Allow CORS only from specific frontend URLs
-origins = ["http://localhost:3000", "https://example.com"]
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema setup is a one-off step (python cli.py init); workers only create it for a fresh dev database.
+    if not DB_PATH.exists():
+        await init_db()
+    item_write_queue = asyncio.Queue()
+    app.state.item_write_queue = item_write_queue
+    background_tasks = [
+        asyncio.create_task(write_item_batches(item_write_queue)),
+        asyncio.create_task(sweep_rate_limit_buckets()),
+    ]
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    pending = []
+    while not item_write_queue.empty():
+        pending.append(item_write_queue.get_nowait())
+    fail_item_writes(pending)
+    # aiosqlite runs each connection on its own non-daemon thread; close them so the worker can exit.
+    await engine.dispose()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app = FastAPI(lifespan=lifespan)
+
+# ==========================
+# Rate Limiting (token bucket per client IP)
+# ==========================
+RATE_LIMIT_SWEEP_INTERVAL = 60
+
+class TokenBucket:
+    __slots__ = ("tokens", "last")
+
+    def __init__(self, cap):
+        self.tokens = cap
+        self.last = time.monotonic()
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
+    def allow(self, rate, cap):
+        now = time.monotonic()
+        self.tokens = min(cap, self.tokens + (now - self.last) * rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
 
-# Handle rate limit exceeded
-@app.exception_handler(RateLimitExceeded)
-async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
-    return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded. Try again later."})
+# (buckets, rate, cap) for every rate_limit dependency, so the sweeper can find them.
+rate_limit_registry = []
+
+def rate_limit(rate: float, cap: int):
+    """Allow `cap` requests in a burst per client IP, refilled at `rate` tokens per second."""
+    buckets = {}
+    rate_limit_registry.append((buckets, rate, cap))
+
+    async def check_rate_limit(request: Request):
+        host = request.client.host if request.client else "127.0.0.1"
+        bucket = buckets.get(host)
+        if bucket is None:
+            bucket = buckets[host] = TokenBucket(cap)
+        if not bucket.allow(rate, cap):
+            raise HTTPException(status_code=429, detail="Rate limit exceeded. Try again later.")
+
+    return check_rate_limit
+
+async def sweep_rate_limit_buckets():
+    # A bucket idle long enough to have refilled completely is the same as a fresh one, so drop it.
+    while True:
+        await asyncio.sleep(RATE_LIMIT_SWEEP_INTERVAL)
+        now = time.monotonic()
+        for buckets, rate, cap in rate_limit_registry:
+            for host in [h for h, b in buckets.items() if b.tokens + (now - b.last) * rate >= cap]:
+                del buckets[host]
 
 # ==========================
 # Dependency to get DB Session
 # ==========================
-def get_db():
+@app.middleware("http")
+async def db_session_scope(request: Request, call_next):
+    scope_token = request_scope.set(object())
+    try:
+        return await call_next(request)
+    finally:
+        request_scope.reset(scope_token)
+
+async def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await SessionLocal.remove()
 
 # ==========================
 # Password Utility Functions
 # ==========================
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def verify_and_update_password(plain_password, hashed_password):
+    """Return (valid, new_hash); new_hash is set when a valid hash uses a deprecated scheme (bcrypt)."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# Verified against when the username doesn't exist, so misses cost the same as a wrong password.
+_DUMMY_HASH = get_password_hash("x")
+
 # ==========================
 # JWT Utility Functions
 # ==========================
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    lifetime = int(expires_delta.total_seconds()) if expires_delta else 15 * 60
+    # Integer epoch seconds, exactly what a datetime exp would be encoded as.
+    to_encode["exp"] = int(time.time()) + lifetime
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def authenticate(token: str):
+    """Return the User a bearer token belongs to, or None if the token is invalid or the user is gone."""
+    key = hashlib.sha256(token.encode()).digest()
+    with token_cache_lock:
+        cached = token_cache.get(key)
+    if cached is not None and cached[2] > time.time():
+        return cached[1]
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "sub"]})
+    except jwt.InvalidTokenError:
+        return None
+    username: str = payload["sub"]
+    exp = payload["exp"]
+    # A short-lived session of its own: the middleware runs before the request's session exists.
+    async with async_session_factory() as db:
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalars().first()
     if user is None:
-        raise credentials_exception
+        return None
+    with token_cache_lock:
+        token_cache[key] = (username, user, exp)
     return user
 
-def get_current_admin(current_user: User = Depends(get_current_user)):
-    if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="You are not authorized to perform this action.")
-    return current_user
+# ==========================
+# Authentication Middleware
+# ==========================
+# Every route under this path requires a bearer token; those routes declare BEARER_AUTH for the docs.
+PROTECTED_PATH = "/items"
+BEARER_AUTH = {"security": [{"OAuth2PasswordBearer": []}]}
+
+def is_protected(path: str):
+    return path == PROTECTED_PATH or path.startswith(PROTECTED_PATH + "/")
+
+def unauthorized(detail: str):
+    return JSONResponse(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        content={"detail": detail},
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+class AuthenticationMiddleware(BaseHTTPMiddleware):
+    """Resolve the bearer token once per request into request.state.user, rejecting bad tokens early."""
+
+    async def dispatch(self, request: Request, call_next):
+        if is_protected(request.url.path):
+            scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return unauthorized("Not authenticated")
+            user = await authenticate(token)
+            if user is None:
+                return unauthorized("Could not validate credentials")
+            request.state.user = user
+        return await call_next(request)
+
+app.add_middleware(AuthenticationMiddleware)
+
+# Allow CORS only from specific frontend URLs
+# Added last so it wraps everything above: preflights and 401s both get CORS headers.
+origins = frozenset({"http://localhost:3000", "https://example.com"})
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,
+    allow_credentials=True,
+    allow_methods=("GET", "POST", "PUT", "DELETE"),
+    allow_headers=("authorization", "content-type"),
+)
 
 # ==========================
 # Input Validation Models
 # ==========================
 class RegisterInput(BaseModel):
-    username: constr(min_length=4, max_length=20)
-    password: constr(min_length=6)
+    model_config = ConfigDict(frozen=True)
+
+    username: str = Field(min_length=4, max_length=20)
+    password: str = Field(min_length=6)
     role: str = "user"
 
 class ItemInput(BaseModel):
-    name: constr(min_length=1, max_length=50)
-    description: constr(min_length=1, max_length=200)
+    model_config = ConfigDict(frozen=True)
+
+    name: str = Field(min_length=1, max_length=50)
+    description: str = Field(min_length=1, max_length=200)
 
 # ==========================
 # User Registration with Validation
 # ==========================
-@app.post("/register/")
-@limiter.limit("5/minute")  # Rate limiting: max 5 registrations per minute per IP
-def register(input: RegisterInput, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == input.username).first()
-    if user:
-        raise HTTPException(status_code=400, detail="Username already registered")
-    hashed_password = get_password_hash(input.password)
+# Rate limiting: max 5 registrations per minute per IP
+@app.post("/register/", dependencies=[Depends(rate_limit(rate=5 / 60, cap=5))])
+async def register(input: RegisterInput, db: AsyncSession = Depends(get_db)):
+    # Hashing is CPU-bound; keep it off the event loop.
+    hashed_password = await run_in_threadpool(get_password_hash, input.password)
     new_user = User(username=input.username, hashed_password=hashed_password, role=input.role)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    # The unique index on username rejects duplicates, so no lookup is needed beforehand.
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Username already registered")
     return {"message": "User registered successfully"}
 
 # ==========================
 # User Login with Rate Limiting
 # ==========================
-@app.post("/login/")
-@limiter.limit("10/minute")  # Rate limiting: max 10 login attempts per minute per IP
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+# Rate limiting: max 10 login attempts per minute per IP
+@app.post("/login/", dependencies=[Depends(rate_limit(rate=10 / 60, cap=10))])
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(User).where(User.username == form_data.username))
+    user = result.scalars().first()
+    # Give the pooled connection back before the slow hash check; the row is already loaded.
+    await db.close()
+    password_ok, new_hash = await run_in_threadpool(
+        verify_and_update_password, form_data.password, user.hashed_password if user else _DUMMY_HASH
+    )
+    if not user or not password_ok:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
+    # Move legacy bcrypt hashes to argon2id on the first successful login.
+    if new_hash is not None:
+        await db.execute(update(User).where(User.id == user.id).values(hashed_password=new_hash))
+        await db.commit()
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(data={"sub": user.username}, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
+# ==========================
+# Batched Item Writes
+# ==========================
+# create_item enqueues (name, description, future); one writer commits up to ITEM_BATCH_SIZE
+# queued items per transaction, waiting at most ITEM_BATCH_WINDOW seconds to fill a batch.
+ITEM_BATCH_SIZE = 50
+ITEM_BATCH_WINDOW = 0.05
+
+def fail_item_writes(entries, exc=None):
+    for _, _, future in entries:
+        if not future.done():
+            future.set_exception(exc or RuntimeError("Item writer stopped before the item was saved"))
+
+async def write_item_batches(queue: asyncio.Queue):
+    while True:
+        batch = [await queue.get()]
+        try:
+            await write_item_batch(queue, batch)
+        except asyncio.CancelledError:
+            fail_item_writes(batch)
+            raise
+
+async def write_item_batch(queue: asyncio.Queue, batch: list):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ITEM_BATCH_WINDOW
+    while len(batch) < ITEM_BATCH_SIZE:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    # One multi-row INSERT ... RETURNING per batch (SQLite 3.35+). Rows get increasing ids in VALUES
+    # order, but RETURNING order is unspecified, so the ids are sorted before pairing with the batch.
+    values = ", ".join(f"(:name_{i}, :description_{i})" for i in range(len(batch)))
+    params = {}
+    for i, (name, description, _) in enumerate(batch):
+        params[f"name_{i}"] = name
+        params[f"description_{i}"] = description
+    try:
+        async with engine.begin() as conn:
+            result = await conn.execute(text(f"INSERT INTO items (name, description) VALUES {values} RETURNING id"), params)
+            item_ids = sorted(result.scalars().all())
+    except Exception as exc:
+        fail_item_writes(batch, exc)
+    else:
+        for (_, _, future), item_id in zip(batch, item_ids):
+            if not future.done():
+                future.set_result(item_id)
+
 # ==========================
 # CRUD Operations (Protected)
 # ==========================
-@app.post("/items/")
-@limiter.limit("20/minute")  # Rate limiting: max 20 item creations per minute per IP
-def create_item(item: ItemInput, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    db_item = Item(name=item.name, description=item.description)
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
-    return {"message": "Item created successfully", "item": {"id": db_item.id, "name": db_item.name, "description": db_item.description}}
-
-@app.get("/items/{item_id}")
-def read_item(item_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    item = db.query(Item).filter(Item.id == item_id).first()
+# Rate limiting: max 20 item creations per minute per IP
+@app.post("/items/", dependencies=[Depends(rate_limit(rate=20 / 60, cap=20))], openapi_extra=BEARER_AUTH)
+async def create_item(item: ItemInput):
+    future = asyncio.get_running_loop().create_future()
+    await app.state.item_write_queue.put((item.name, item.description, future))
+    item_id = await future
+    return {"message": "Item created successfully", "item": {"id": item_id, "name": item.name, "description": item.description}}
+
+@app.get("/items/{item_id}", openapi_extra=BEARER_AUTH)
+async def read_item(item_id: int, db: AsyncSession = Depends(get_db)):
+    item = await db.get(Item, item_id)
     if item is None:
         raise HTTPException(status_code=404, detail="Item not found")
     return {"id": item.id, "name": item.name, "description": item.description}
 
-@app.put("/items/{item_id}")
-def update_item(item_id: int, item: ItemInput, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    item_record = db.query(Item).filter(Item.id == item_id).first()
+@app.put("/items/{item_id}", openapi_extra=BEARER_AUTH)
+async def update_item(item_id: int, item: ItemInput, db: AsyncSession = Depends(get_db)):
+    item_record = await db.get(Item, item_id)
     if item_record is None:
         raise HTTPException(status_code=404, detail="Item not found")
     item_record.name = item.name
     item_record.description = item.description
-    db.commit()
+    await db.commit()
     return {"message": "Item updated successfully", "item": {"id": item_record.id, "name": item_record.name, "description": item_record.description}}
 
-@app.delete("/items/{item_id}")
-def delete_item(item_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin)):
-    item = db.query(Item).filter(Item.id == item_id).first()
+@app.delete("/items/{item_id}", openapi_extra=BEARER_AUTH)
+async def delete_item(item_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    if request.state.user.role != "admin":
+        raise HTTPException(status_code=403, detail="You are not authorized to perform this action.")
+    item = await db.get(Item, item_id)
     if item is None:
         raise HTTPException(status_code=404, detail="Item not found")
-    db.delete(item)
-    db.commit()
+    await db.delete(item)
+    await db.commit()
     return {"message": "Item deleted successfully"}
 
+# ==========================
+# OpenAPI Security Scheme
+# ==========================
+# Auth runs in middleware, so no route dependency registers the scheme; declare it for /docs "Authorize".
+def custom_openapi():
+    if app.openapi_schema:
+        return app.openapi_schema
+    schema = get_openapi(title=app.title, version=app.version, routes=app.routes)
+    schema.setdefault("components", {})["securitySchemes"] = {
+        "OAuth2PasswordBearer": {"type": "oauth2", "flows": {"password": {"scopes": {}, "tokenUrl": "login"}}}
+    }
+    app.openapi_schema = schema
+    return schema
+
+app.openapi = custom_openapi
+
 # ==========================
 # Global Error Handler Example
 # ==========================
+# Set DEBUG=1 to include the exception message in 500 responses.
+DEBUG = os.getenv("DEBUG") == "1"
+
+# Built once and reused. The traceback is logged by the server, since Starlette re-raises after this handler.
+_ERR_500 = JSONResponse(status_code=500, content={"detail": "Internal server error"})
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
+    if not DEBUG:
+        return _ERR_500
     return JSONResponse(
         status_code=500,
         content={"detail": f"An unexpected error occurred: {str(exc)}"}
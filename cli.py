@@ -0,0 +1,24 @@
+import argparse
+import asyncio
+
+from app import engine, init_db
+
+
+async def run_init():
+    await init_db()
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Management commands for the items API")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("init", help="Create the database tables")
+    args = parser.parse_args()
+
+    if args.command == "init":
+        asyncio.run(run_init())
+        print("Database initialized")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
+from cachetools.func import ttl_cache
 import os
 
 
@@ -12,6 +13,34 @@ env_api_key = os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=env_api_key)
 model = genai.GenerativeModel("gemini-1.5-pro")
 
+# Reads the reply text straight from the first candidate, skipping the checks response.text repeats on every access
+# Raises ValueError like response.text when the prompt or reply was blocked, so nothing empty gets cached
+def response_text(response):
+    if not response.candidates:
+        raise ValueError(f"Gemini returned no candidates (prompt feedback: {response.prompt_feedback})")
+    candidate = response.candidates[0]
+    parts = candidate.content.parts
+    if not parts:
+        raise ValueError(f"Gemini returned no text (finish reason: {candidate.finish_reason})")
+    if len(parts) == 1:
+        return parts[0].text
+    return "".join(part.text for part in parts)
+
+# Repeated questions are answered from memory for up to an hour instead of another round trip to Gemini
+@ttl_cache(maxsize=128, ttl=3600)
 def ask_gemini(question):
     response = model.generate_content(question)
-    return response.text
\ No newline at end of file
+    return response_text(response)
+
+# Yields the answer piece by piece as Gemini produces it, so callers can show text before the full reply arrives
+def ask_gemini_stream(question):
+    response = model.generate_content(question, stream=True)
+    produced_text = False
+    for chunk in response:
+        # The final chunk may carry only the finish reason or safety ratings; only an empty stream is an error
+        if not chunk.candidates or not chunk.candidates[0].content.parts:
+            continue
+        produced_text = True
+        yield response_text(chunk)
+    if not produced_text:
+        raise ValueError(f"Gemini streamed no text (prompt feedback: {response.prompt_feedback})")
\ No newline at end of file
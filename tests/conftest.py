@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# app.py builds its engine at import time, so point it at a scratch database before any test imports it.
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
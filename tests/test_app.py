@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select, text
+
+import app as app_module
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    # The lifespan disposes the engine after each test, so the file can go and the next test recreates it.
+    for suffix in ("", "-wal", "-shm"):
+        path = f"{app_module.DB_PATH}{suffix}"
+        if os.path.exists(path):
+            os.remove(path)
+    app_module.token_cache.clear()
+    for buckets, _, _ in app_module.rate_limit_registry:
+        buckets.clear()
+
+
+def run_with_client(scenario):
+    async def main():
+        async with app_module.app.router.lifespan_context(app_module.app):
+            transport = httpx.ASGITransport(app=app_module.app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await scenario(client)
+
+    return asyncio.run(main())
+
+
+async def auth_headers(client, username="alice", role="user"):
+    await client.post("/register/", json={"username": username, "password": "secret1", "role": role})
+    response = await client.post("/login/", data={"username": username, "password": "secret1"})
+    return {"Authorization": "Bearer " + response.json()["access_token"]}
+
+
+@pytest.fixture
+def auth_calls(monkeypatch):
+    """Count token decodes and user lookups made while authenticating requests."""
+    calls = {"decode": 0, "lookup": 0}
+    real_decode = app_module.jwt.decode
+    real_session_factory = app_module.async_session_factory
+
+    def counting_decode(*args, **kwargs):
+        calls["decode"] += 1
+        return real_decode(*args, **kwargs)
+
+    def counting_session_factory():
+        calls["lookup"] += 1
+        return real_session_factory()
+
+    monkeypatch.setattr(app_module.jwt, "decode", counting_decode)
+    monkeypatch.setattr(app_module, "async_session_factory", counting_session_factory)
+    return calls
+
+
+def test_token_cache_hit_skips_decode_and_user_lookup(auth_calls):
+    async def scenario(client):
+        headers = await auth_headers(client)
+        first = await client.get("/items/999", headers=headers)
+        second = await client.get("/items/999", headers=headers)
+        return first, second
+
+    first, second = run_with_client(scenario)
+    assert first.status_code == second.status_code == 404
+    assert auth_calls == {"decode": 1, "lookup": 1}
+
+
+def test_token_cache_entry_is_not_served_past_exp(auth_calls):
+    async def scenario(client):
+        headers = await auth_headers(client)
+        await client.get("/items/999", headers=headers)
+        key = hashlib.sha256(headers["Authorization"].split(" ", 1)[1].encode()).digest()
+        username, user, _ = app_module.token_cache[key]
+        app_module.token_cache[key] = (username, user, time.time() - 1)
+        return await client.get("/items/999", headers=headers)
+
+    assert run_with_client(scenario).status_code == 404
+    assert auth_calls == {"decode": 2, "lookup": 2}
+
+
+def test_unknown_user_login_verifies_against_dummy_hash(monkeypatch):
+    verified_hashes = []
+    real_verify = app_module.verify_and_update_password
+
+    def recording_verify(plain_password, hashed_password):
+        verified_hashes.append(hashed_password)
+        return real_verify(plain_password, hashed_password)
+
+    monkeypatch.setattr(app_module, "verify_and_update_password", recording_verify)
+
+    async def scenario(client):
+        return await client.post("/login/", data={"username": "nobody", "password": "secret1"})
+
+    response = run_with_client(scenario)
+    assert response.status_code == 400
+    assert verified_hashes == [app_module._DUMMY_HASH]
+
+
+def test_login_rehashes_legacy_bcrypt_password():
+    async def scenario(client):
+        await client.post("/register/", json={"username": "alice", "password": "secret1"})
+        legacy_hash = app_module.pwd_context.handler("bcrypt").hash("secret1")
+        async with app_module.engine.begin() as conn:
+            await conn.execute(text("UPDATE users SET hashed_password = :h WHERE username = 'alice'"), {"h": legacy_hash})
+        first = await client.post("/login/", data={"username": "alice", "password": "secret1"})
+        async with app_module.engine.connect() as conn:
+            stored = (await conn.execute(text("SELECT hashed_password FROM users WHERE username = 'alice'"))).scalar_one()
+        second = await client.post("/login/", data={"username": "alice", "password": "secret1"})
+        return first, stored, second
+
+    first, stored, second = run_with_client(scenario)
+    assert first.status_code == 200
+    assert stored.startswith("$argon2id$")
+    assert second.status_code == 200
+
+
+def test_rate_limit_rejects_request_after_cap():
+    async def scenario(client):
+        return [
+            (await client.post("/login/", data={"username": "nobody", "password": "wrong"})).status_code
+            for _ in range(11)
+        ]
+
+    # /login/ allows a burst of 10 per client IP.
+    assert run_with_client(scenario) == [400] * 10 + [429]
+
+
+def test_duplicate_username_returns_400():
+    async def scenario(client):
+        payload = {"username": "alice", "password": "secret1"}
+        first = await client.post("/register/", json=payload)
+        second = await client.post("/register/", json=payload)
+        return first, second
+
+    first, second = run_with_client(scenario)
+    assert first.status_code == 200
+    assert second.status_code == 400
+    assert second.json() == {"detail": "Username already registered"}
+
+
+def test_duplicate_username_rolls_back_and_leaves_session_usable():
+    async def scenario(client):
+        payload = app_module.RegisterInput(username="alice", password="secret1")
+        async with app_module.async_session_factory() as db:
+            await app_module.register(payload, db)
+            with pytest.raises(HTTPException) as excinfo:
+                await app_module.register(payload, db)
+            # Without the rollback this query would fail with PendingRollbackError.
+            usernames = (await db.execute(select(app_module.User.username))).scalars().all()
+        return excinfo.value, usernames
+
+    error, usernames = run_with_client(scenario)
+    assert error.status_code == 400
+    assert usernames == ["alice"]